@@ -0,0 +1,115 @@
+"""对话历史内存占用基准测试
+
+比较在同一进程中保存大量会话时，原来的 dict 列表与 MessageStore 的 RSS 占用。
+每种方式在独立的子进程里运行，互不影响。分两种场景：
+- shared: 各会话的工具结果和系统提示词大量重复，主要体现共享缓冲区的去重效果；
+- unique: 每个会话的工具结果和系统提示词都不同，无法去重，体现记录本身的开销。
+
+用法: python bench_memory.py [会话数量，默认 10000] [每个会话的轮数，默认 5]
+"""
+import gc
+import json
+import os
+import subprocess
+import sys
+
+from client_20250316 import SYSTEM_PROMPT
+from message_store import MessageStore, shared_buffer
+
+TOOLS_DESC = "\n- ".join([
+    "get_alerts: Get weather alerts for a US state.",
+    "get_forecast: Get weather forecast for a location.",
+    "get_alerts_bulk: Get weather alerts for several US states in one call.",
+    "get_forecast_bulk: Get weather forecasts for several locations in one call.",
+])
+STATES = ["CA", "NY", "TX", "FL", "WA", "OR", "AZ", "NV", "CO", "UT"]
+
+
+def tool_payload(state: str, tag: str = "") -> str:
+    """模拟 str(result.content)，每次都生成新的字符串对象；tag 不同则内容不同"""
+    alert = (
+        f"\nEvent: Heat Advisory{tag}\nArea: {state} Central Valley\nSeverity: Moderate\n"
+        "Description: Hot conditions with temperatures up to 105 expected.\n"
+        "Instructions: Drink plenty of fluids, stay in an air-conditioned room.\n"
+    )
+    return str([{"type": "text", "text": "\n---\n".join([alert] * 6)}])
+
+
+def build_session(session_id: int, turns: int, unique: bool = False) -> list[dict]:
+    tools_desc = TOOLS_DESC + (f"\n- session_{session_id}: per-session tool" if unique else "")
+    messages = [{"role": "system", "content": SYSTEM_PROMPT.format(tools=tools_desc)}]
+    for turn in range(turns):
+        state = STATES[(session_id + turn) % len(STATES)]
+        call_id = f"call_{session_id}_{turn}"
+        messages.append({"role": "user", "content": f"Any weather alerts in {state} today? ({session_id}/{turn})"})
+        messages.append({
+            "role": "assistant",
+            "content": "",
+            "tool_calls": [{
+                "id": call_id,
+                "type": "function",
+                "function": {"name": "get_alerts", "arguments": json.dumps({"state": state})},
+            }],
+        })
+        payload = tool_payload(state, f" #{session_id}/{turn}" if unique else "")
+        messages.append({"role": "tool", "tool_call_id": call_id, "name": "get_alerts", "content": payload})
+        messages.append({"role": "assistant", "content": f"There is a heat advisory in {state}. Stay cool! ({session_id}/{turn})"})
+    return messages
+
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(mode: str, sessions: int, turns: int, unique: bool) -> None:
+    gc.collect()
+    before = rss_kb()
+    held = []
+    for session_id in range(sessions):
+        messages = build_session(session_id, turns, unique)
+        if mode == "store":
+            store = MessageStore()
+            for message in messages:
+                store.append(message)
+            messages = store
+        held.append(messages)
+    gc.collect()
+    after = rss_kb()
+    print(json.dumps({"mode": mode, "rss_kb": after - before, "buffer_entries": len(shared_buffer)}))
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    if os.environ.get("BENCH_MEMORY_MODE"):
+        run(os.environ["BENCH_MEMORY_MODE"], sessions, turns, os.environ.get("BENCH_MEMORY_PAYLOADS") == "unique")
+        return
+
+    print(f"{sessions} sessions x {turns} turns")
+    for payloads in ("shared", "unique"):
+        results = {}
+        for mode in ("dict", "store"):
+            output = subprocess.run(
+                [sys.executable, __file__, str(sessions), str(turns)],
+                env={**os.environ, "BENCH_MEMORY_MODE": mode, "BENCH_MEMORY_PAYLOADS": payloads},
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+
+        print(f" {payloads} payloads")
+        for mode, result in results.items():
+            print(f"  {mode:<6} RSS +{result['rss_kb'] / 1024:.1f} MiB")
+        if results["store"]["rss_kb"]:
+            print(f"  ratio  {results['dict']['rss_kb'] / results['store']['rss_kb']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
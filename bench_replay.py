@@ -0,0 +1,77 @@
+"""用录制文件对 MCPClient 做回放压测
+
+多个客户端并发回放同一个录制文件（每个客户端有独立的回放游标），
+依次发送录制中的查询。speed=0 时不等待录制耗时，测得的就是客户端自身的开销。
+设置 --timeout 时按截止时间取消查询，并统计发送的取消通知和省下的上游耗时。
+
+用法: python bench_replay.py trace.jsonl.gz [--clients 50] [--speed 0] [--timeout 5] [--profile]
+"""
+import argparse
+import asyncio
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import time
+from typing import Optional
+
+from cassette import Cassette
+from client_20250316 import MCPClient
+
+
+async def replay_client(cassette: Cassette, queries: list[str], speed: float, timeout: Optional[float]) -> dict:
+    client = MCPClient()
+    player = await client.connect_replay(cassette, speed)
+    for query in queries:
+        await client.process_query(query, timeout)
+    await client.cleanup()
+    return {
+        "queries": len(queries),
+        "cancelled_queries": client.cancelled["queries"],
+        "cancel_notifications": player.cancel_notifications,
+        "freed_seconds": player.freed_seconds,
+    }
+
+
+async def run(cassette: Cassette, clients: int, speed: float, timeout: Optional[float]) -> tuple[dict, float]:
+    queries = cassette.queries()
+    started = time.perf_counter()
+    # 客户端的日志输出很多，压测时丢弃
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = await asyncio.gather(*[replay_client(cassette, queries, speed, timeout) for _ in range(clients)])
+    totals = {key: sum(result[key] for result in results) for key in results[0]} if results else {}
+    return totals, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cassette")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--speed", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=None, help="deadline in seconds for each query")
+    parser.add_argument("--profile", action="store_true", help="print the top functions by cumulative time")
+    args = parser.parse_args()
+
+    cassette = Cassette.load(args.cassette)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    totals, seconds = asyncio.run(run(cassette, args.clients, args.speed, args.timeout))
+    queries = totals.get("queries", 0)
+    if profiler:
+        profiler.disable()
+
+    print(f"{args.clients} clients, {queries} queries in {seconds:.3f}s ({queries / seconds:.1f} queries/s)")
+    print(f"recorded upstream time per client: {cassette.recorded_seconds():.3f}s")
+    if args.timeout is not None:
+        print(f"cancelled {totals['cancelled_queries']} queries, sent {totals['cancel_notifications']} "
+              f"tool cancellations, freed {totals['freed_seconds']:.3f}s of recorded upstream time")
+    if profiler:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(20)
+        print(out.getvalue())
+
+
+if __name__ == "__main__":
+    main()
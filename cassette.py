@@ -0,0 +1,292 @@
+"""LLM 与 MCP 交互的录制 / 回放
+
+录制模式下，包装真实的 OpenAI 客户端和 MCP ClientSession，把每次 chat completion
+的请求/响应、每次 call_tool / list_tools 的请求/结果以及耗时写入一个 JSON Lines
+文件（文件名以 .gz 结尾时使用 gzip 压缩）。每次请求都会带上完整的对话历史和工具列表，
+因此消息和工具列表按内容哈希去重：每条不同的内容只写一次 blob 记录，llm 记录里只保存哈希。
+
+回放模式下，用替身对象按录制内容返回结果，不需要访问 DeepSeek 或启动 MCP Server：
+speed=1 按录制时的耗时回放，speed=2 两倍速，speed=0 不等待、尽可能快。
+这样可以单独分析客户端自身的开销，也可以把线上录制的记录当作压测输入。
+回放时会校验收到的请求，与录制不一致时抛出 CassetteMismatch。
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections import defaultdict, deque
+from typing import Any, Optional
+
+from mcp import types
+from openai.types.chat import ChatCompletion
+
+from inflight import call_key
+
+CASSETTE_VERSION = 2
+
+
+class CassetteMismatch(LookupError):
+    """回放时收到了录制文件中没有的请求"""
+
+
+def content_hash(value: Any) -> str:
+    """消息或工具列表的内容哈希，录制和回放使用同一种规范化方式"""
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def turn_key(model: str, message_hashes: list[str], roles: list[str], tools_hash: Optional[str]) -> str:
+    """回放时匹配 LLM 请求的 key：模型、当前这一轮（最后一条 user 消息及之后）的消息和工具列表
+
+    之前的历史可能因为查询被取消或预算压缩而与录制时不同，不参与匹配。
+    """
+    start = max((i for i, role in enumerate(roles) if role == "user"), default=0)
+    return call_key(model, {"turn": message_hashes[start:], "tools": tools_hash})
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """一个录制文件
+
+    Args:
+        path: 录制文件路径
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: list[dict] = []
+        # 哈希 -> 消息或工具列表
+        self.blobs: dict[str, Any] = {}
+        self._file = None
+        self._started = 0.0
+
+    # ---------- 录制 ----------
+
+    def start_recording(self) -> None:
+        self._file = _open(self.path, "w")
+        self._started = time.perf_counter()
+        self._write({"kind": "header", "version": CASSETTE_VERSION, "recorded_at": time.time()})
+
+    def _write(self, entry: dict) -> None:
+        self.entries.append(entry)
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def record(self, kind: str, request: Any, response: Any, started: float) -> None:
+        """记录一次交互，started 为请求开始时的 time.perf_counter()"""
+        now = time.perf_counter()
+        self._write({
+            "kind": kind,
+            "offset": round(started - self._started, 6),
+            "elapsed": round(now - started, 6),
+            "request": request,
+            "response": response,
+        })
+
+    def store(self, value: Any) -> str:
+        """写入一条 blob 记录（相同内容只写一次），返回它的哈希"""
+        digest = content_hash(value)
+        if digest not in self.blobs:
+            self.blobs[digest] = value
+            self._write({"kind": "blob", "hash": digest, "value": value})
+        return digest
+
+    def record_llm(self, kwargs: dict, response: Any, started: float) -> None:
+        """记录一次 chat completion，消息和工具列表以哈希代替"""
+        request = dict(kwargs)
+        request["messages"] = [self.store(message) for message in kwargs["messages"]]
+        if "tools" in kwargs:
+            request["tools"] = self.store(kwargs["tools"])
+        self.record("llm", request, response, started)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def recording_openai(self, openai) -> "RecordingOpenAI":
+        return RecordingOpenAI(openai, self)
+
+    def recording_session(self, session) -> "RecordingSession":
+        return RecordingSession(session, self)
+
+    # ---------- 回放 ----------
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        cassette = cls(path)
+        with _open(path, "r") as f:
+            cassette.entries = [json.loads(line) for line in f if line.strip()]
+        header = cassette.entries[0] if cassette.entries else {}
+        if header.get("kind") != "header" or header.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"{path} is not a version {CASSETTE_VERSION} cassette")
+        cassette.blobs = {entry["hash"]: entry["value"] for entry in cassette.entries if entry["kind"] == "blob"}
+        return cassette
+
+    def messages(self, entry: dict) -> list[dict]:
+        """还原一条 llm 记录的完整消息列表"""
+        return [self.blobs[digest] for digest in entry["request"]["messages"]]
+
+    def queries(self) -> list[str]:
+        """录制中用户的查询（每次带工具的首个请求中最后一条 user 消息）"""
+        queries = []
+        for entry in self.entries:
+            if entry["kind"] == "llm" and "tools" in entry["request"]:
+                user_messages = [m for m in self.messages(entry) if m["role"] == "user"]
+                if user_messages:
+                    queries.append(user_messages[-1]["content"])
+        return queries
+
+    def recorded_seconds(self) -> float:
+        """录制中 LLM 和工具调用耗时的总和"""
+        return sum(entry.get("elapsed", 0.0) for entry in self.entries)
+
+    def player(self, speed: float = 0.0) -> "Player":
+        """创建一个独立的回放游标，多个并发客户端可以各自回放同一个录制"""
+        return Player(self, speed)
+
+
+class RecordingOpenAI:
+    """包装 AsyncOpenAI，记录 chat.completions.create 的请求和响应"""
+
+    def __init__(self, openai, cassette: Cassette):
+        self._openai = openai
+        self._cassette = cassette
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        started = time.perf_counter()
+        response = await self._openai.chat.completions.create(**kwargs)
+        self._cassette.record_llm(kwargs, response.model_dump(mode="json"), started)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._openai, name)
+
+
+class RecordingSession:
+    """包装 ClientSession，记录 call_tool 和 list_tools，其余属性直接转发"""
+
+    def __init__(self, session, cassette: Cassette):
+        self._session = session
+        self._cassette = cassette
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, *args, **kwargs):
+        started = time.perf_counter()
+        result = await self._session.call_tool(name, arguments, *args, **kwargs)
+        self._cassette.record("tool", {"name": name, "arguments": arguments}, result.model_dump(mode="json", by_alias=True), started)
+        return result
+
+    async def list_tools(self, *args, params: Optional[types.PaginatedRequestParams] = None, **kwargs):
+        started = time.perf_counter()
+        if params is not None:
+            kwargs["params"] = params
+        result = await self._session.list_tools(*args, **kwargs)
+        request = {"cursor": params.cursor} if params is not None and params.cursor else {}
+        self._cassette.record("list_tools", request, result.model_dump(mode="json", by_alias=True), started)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class Player:
+    """按录制内容回放
+
+    LLM 请求按 turn_key 匹配，相同 key 的请求按录制顺序回放；被取消的查询剩下的录制请求
+    不会被消费，也不会被后面的请求误用。工具调用按工具名加参数匹配，允许并发调用的顺序与录制时不同。
+    """
+
+    def __init__(self, cassette: Cassette, speed: float = 0.0):
+        self.speed = speed
+        # 收到的取消通知数量，以及因取消而省下的录制耗时（秒）
+        self.cancel_notifications = 0
+        self.freed_seconds = 0.0
+        self._llm: dict[str, deque[dict]] = defaultdict(deque)
+        self._list_tools: deque[dict] = deque()
+        self._tools: dict[str, deque[dict]] = defaultdict(deque)
+        for entry in cassette.entries:
+            if entry["kind"] == "llm":
+                request = entry["request"]
+                roles = [message["role"] for message in cassette.messages(entry)]
+                key = turn_key(request["model"], request["messages"], roles, request.get("tools"))
+                self._llm[key].append(entry)
+            elif entry["kind"] == "list_tools":
+                self._list_tools.append(entry)
+            elif entry["kind"] == "tool":
+                request = entry["request"]
+                self._tools[call_key(request["name"], request["arguments"])].append(entry)
+        self.openai = ReplayOpenAI(self)
+        self.session = ReplaySession(self)
+
+    async def _wait(self, entry: dict) -> None:
+        if self.speed:
+            started = time.perf_counter()
+            try:
+                await asyncio.sleep(entry["elapsed"] / self.speed)
+            except asyncio.CancelledError:
+                waited = (time.perf_counter() - started) * self.speed
+                self.freed_seconds += max(0.0, entry["elapsed"] - waited)
+                raise
+        else:
+            # 仍然让出一次事件循环，保持与真实 I/O 相同的调度方式
+            await asyncio.sleep(0)
+
+
+class ReplayOpenAI:
+    """替身 AsyncOpenAI，只支持 chat.completions.create"""
+
+    def __init__(self, player: Player):
+        self._player = player
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        messages = kwargs["messages"]
+        tools_hash = content_hash(kwargs["tools"]) if "tools" in kwargs else None
+        key = turn_key(kwargs["model"], [content_hash(m) for m in messages], [m["role"] for m in messages], tools_hash)
+        queue = self._player._llm.get(key)
+        if not queue:
+            user_messages = [m["content"] for m in messages if m["role"] == "user"]
+            last_user = user_messages[-1] if user_messages else None
+            raise CassetteMismatch(f"no recorded chat completion matches the request (last user message: {last_user!r})")
+        entry = queue.popleft()
+        await self._player._wait(entry)
+        return ChatCompletion.model_validate(entry["response"])
+
+
+class ReplaySession:
+    """替身 ClientSession，只支持 call_tool、list_tools 和 send_notification"""
+
+    def __init__(self, player: Player):
+        self._player = player
+        self._request_id = 0
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, *args, **kwargs):
+        self._request_id += 1
+        queue = self._player._tools.get(call_key(name, arguments))
+        if not queue:
+            raise CassetteMismatch(f"no recorded call_tool for {name}({arguments})")
+        entry = queue.popleft()
+        await self._player._wait(entry)
+        return types.CallToolResult.model_validate(entry["response"])
+
+    async def list_tools(self, *args, **kwargs):
+        if not self._player._list_tools:
+            raise CassetteMismatch("no more recorded list_tools")
+        # 保留最后一次 list_tools，重复调用时返回最新的工具列表
+        queue = self._player._list_tools
+        entry = queue.popleft() if len(queue) > 1 else queue[0]
+        await self._player._wait(entry)
+        return types.ListToolsResult.model_validate(entry["response"])
+
+    async def send_notification(self, notification, *args, **kwargs):
+        if isinstance(notification.root, types.CancelledNotification):
+            self._player.cancel_notifications += 1
@@ -0,0 +1,64 @@
+"""Failure-rate circuit breaker used by weather_new.py for each NWS endpoint."""
+from collections import deque
+import time
+
+# Circuit breaker settings
+BREAKER_WINDOW = 20           # number of recent requests used for the failure rate
+BREAKER_MIN_REQUESTS = 5      # don't trip before this many requests in the window
+BREAKER_FAILURE_RATE = 0.5    # open the circuit at or above this failure rate
+BREAKER_OPEN_SECONDS = 30.0   # how long to fail fast before probing again
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one upstream endpoint.
+
+    closed: requests pass and outcomes are recorded.
+    open: requests fail immediately until BREAKER_OPEN_SECONDS have passed.
+    half_open: a single probe request is let through; its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.outcomes: deque[bool] = deque(maxlen=BREAKER_WINDOW)
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+        return self.state == "closed"
+
+    def record(self, success: bool) -> None:
+        if self.state == "open":
+            # Requests started before the circuit opened; don't let them extend the open window
+            return
+        if self.state == "half_open":
+            self.probing = False
+            if success:
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self._open()
+            return
+        self.outcomes.append(success)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= BREAKER_MIN_REQUESTS and failures / len(self.outcomes) >= BREAKER_FAILURE_RATE:
+            self._open()
+
+    def abandon(self) -> None:
+        """The request was cancelled before an outcome was known."""
+        self.probing = False
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+
+    def retry_in(self) -> float:
+        return max(0.0, BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at))
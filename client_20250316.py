@@ -2,12 +2,25 @@ import asyncio
 from typing import Optional
 from contextlib import AsyncExitStack
 import json
+import time
 # 导入 MCP 相关模块
 from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 # 导入 OpenAI API 和环境变量加载工具
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
+# 导入工具参数校验
+from tool_schema import ToolArgumentError, ToolValidators
+# 导入相同工具调用的合并登记表
+from inflight import InflightCalls
+# 导入紧凑的对话历史存储
+from message_store import ContentBuffer, MessageStore
+# 导入 token 用量统计与预算控制
+from usage import BudgetExceeded, QueryResult, QueryUsage, UsageTracker, estimate_tokens
+# 导入 LLM 与 MCP 交互的录制 / 回放
+from cassette import Cassette
+# 导入工具列表的分页获取与本地快照
+from tool_catalog import fetch_all_tools, iter_tool_pages, load_snapshot, same_tools, save_snapshot, snapshot_key
 # 加载 .env 文件中的环境变量
 load_dotenv()  # load environment variables from .env
 # 系统提示词，用于定义 AI 助手的行为和能力
@@ -22,25 +35,44 @@ SYSTEM_PROMPT = """You are a helpful assistant capable of accessing external fun
 - Always highlight the potential of available tools to assist users comprehensively."""
 
 class MCPClient:
-    def __init__(self):
+    def __init__(self, inflight: Optional[InflightCalls] = None, content_buffer: Optional[ContentBuffer] = None,
+                 session_budget: Optional[int] = None, query_budget: Optional[int] = None,
+                 completion_reserve: int = 1024):
         # Initialize session and client objects
         self.session: Optional[ClientSession] = None
         # 创建异步上下文管理器，用于动态管理退出回调堆栈
         self.exit_stack = AsyncExitStack()
         # 初始化 OpenAI 客户端
         self.openai = AsyncOpenAI(base_url="https://api.deepseek.com")
-        # 存储对话历史
-        self.messages = []
+        # 存储对话历史，大段内容保存在进程内共享的缓冲区中
+        self.messages = MessageStore(content_buffer)
         # 存储可用工具
         self.tools = []
         self.tools_updated = False  # 标记工具是否更新
-        self._notification_task = None
+        # 按工具缓存编译好的参数校验函数
+        self.validators = ToolValidators()
+        # 进行中的工具调用登记表，相同调用只发送一次；
+        # 连接同一个 MCP Server 的多个对话可以传入同一个实例共享
+        self.inflight = inflight or InflightCalls()
+        # token 用量统计，可设置会话和单次查询的 token 预算，以及每次请求为回复预留的 token 数
+        self.usage = UsageTracker(session_budget, query_budget, completion_reserve)
+        # 录制模式下的录制文件
+        self.cassette: Optional[Cassette] = None
+        # 后台获取剩余工具页 / 与快照对齐 / 收到更新通知后重新获取工具列表的任务，同一时间只有一个
+        self._catalog_task = None
+        self._snapshot_key: Optional[str] = None
+        # 因超时或中止而取消的查询和工具调用数量
+        self.cancelled = {"queries": 0, "tool_calls": 0}
+        # 当前这一轮用户消息在历史中的位置，取消查询时从这里回滚；
+        # 预算压缩会删除更早的对话，不能用查询开始前的历史长度回滚
+        self._turn_start: Optional[int] = None
 
-    async def connect_to_server(self, server_script_path: str):
+    async def connect_to_server(self, server_script_path: str, cassette: Optional[Cassette] = None):
         """Connect to an MCP server
         
         Args:
             server_script_path: Path to the server script (.py or .js)
+            cassette: If given, record all LLM and MCP traffic into it
         """
         is_python = server_script_path.endswith('.py')
         is_js = server_script_path.endswith('.js')
@@ -60,122 +92,290 @@ class MCPClient:
         self.stdio, self.write = stdio_transport
         print("使用 AsyncExitStack 管理 stdio_client 的生命周期")
         print("建立与MCP服务器的连接...，并使用stdio读写流与MCP服务器通信")
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
+        # 服务器发来的通知和请求交给 _handle_message 处理
+        self.session = await self.exit_stack.enter_async_context(
+            ClientSession(self.stdio, self.write, message_handler=self._handle_message)
+        )
+        if cassette is not None:
+            # 录制模式：包装 OpenAI 客户端和 MCP 会话
+            cassette.start_recording()
+            self.cassette = cassette
+            self.openai = cassette.recording_openai(self.openai)
+            self.session = cassette.recording_session(self.session)
+            print(f"录制 LLM 与 MCP 交互到: {cassette.path}")
         print("初始化MCP客户端会话...")
-        await self.session.initialize()
+        init_result = await self.session.initialize()
+        self._snapshot_key = snapshot_key(command, server_params.args, init_result.serverInfo)
         print("MCP客户端会话初始化完成")
 
-        # 启动通知监听
-        self._notification_task = asyncio.create_task(self._handle_notifications())
-        print("启动监听任务-mcp-client监听mcp-server的通知")
-
         # List available tools
-        response = await self.session.list_tools()
-        self.tools = response.tools
+        snapshot = load_snapshot(self._snapshot_key)
+        if snapshot is not None:
+            # 先使用本地快照，后台再与服务器的工具列表对齐
+            print("使用本地工具列表快照，后台与服务器对齐")
+            self._init_tools(snapshot)
+            self._catalog_task = asyncio.create_task(self._reconcile_tools())
+        else:
+            # 拿到第一页就开始使用，剩余的页在后台获取
+            pages = iter_tool_pages(self.session)
+            self._init_tools(await anext(pages))
+            self._catalog_task = asyncio.create_task(self._load_remaining_tools(pages))
+
+    async def connect_replay(self, cassette: Cassette, speed: float = 0.0):
+        """Replay a recorded cassette instead of connecting to DeepSeek and an MCP server
+
+        Args:
+            cassette: Cassette loaded with Cassette.load()
+            speed: 1 replays at recorded speed, 0 as fast as possible
+        """
+        player = cassette.player(speed)
+        self.openai = player.openai
+        self.session = player.session
+        print(f"回放录制文件: {cassette.path}")
+        self._init_tools(await fetch_all_tools(self.session))
+        return player
+
+    def _set_tools(self, tools):
+        """替换工具列表，下一次查询时更新系统提示词"""
+        self.tools = tools
+        self.validators.load(self.tools)
+        self.tools_updated = True
+
+    async def _load_remaining_tools(self, pages):
+        """在后台获取剩余的工具页，每获取一页就可以使用，全部获取后保存快照"""
+        try:
+            tools = list(self.tools)
+            async for page in pages:
+                tools = tools + page
+                self._set_tools(tools)
+                print(f"获取到下一页工具: {[tool.name for tool in page]}")
+            save_snapshot(self._snapshot_key, tools)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"获取工具列表出错: {e}")
+
+    async def _reconcile_tools(self):
+        """在后台获取服务器的最新工具列表，与快照不一致时替换并更新快照"""
+        try:
+            tools = await fetch_all_tools(self.session)
+            if not same_tools(tools, self.tools):
+                self._set_tools(tools)
+                save_snapshot(self._snapshot_key, tools)
+                print(f"工具列表快照已过期，已更新为: {[tool.name for tool in self.tools]}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"与服务器对齐工具列表出错: {e}")
+
+    async def _refresh_tools(self):
+        """收到工具列表更新通知后重新获取完整的工具列表并更新快照"""
+        try:
+            self._set_tools(await fetch_all_tools(self.session))
+            if self._snapshot_key is not None:
+                save_snapshot(self._snapshot_key, self.tools)
+            print(f"MCP Server 的工具列表已更新: {[tool.name for tool in self.tools]}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"重新获取工具列表出错: {e}")
+
+    def _init_tools(self, tools):
+        """保存工具列表并初始化系统消息"""
+        self.tools = tools
+        self.validators.load(self.tools)
+        self.tools_updated = False
         print(f"获取到MCP服务器可用工具: {[tool.name for tool in self.tools]}")
         
         # Initialize system message with available tools
         tools_desc = "\n- ".join([f"{tool.name}: {tool.description}" for tool in self.tools])
-        self.messages = [{
+        self.messages.clear()
+        self.messages.append({
             "role": "system",
             "content": SYSTEM_PROMPT.format(tools=tools_desc)
-        }]
+        })
         
-        print(f"将可用工具填入SYSTEM_PROMPT并初始化系统消息: {self.messages}")
+        print(f"将可用工具填入SYSTEM_PROMPT并初始化系统消息: {self.messages[0]}")
 
-    async def _handle_notifications(self):
-        """监听服务器消息和通知"""
+    async def _handle_message(self, message):
+        """处理服务器发来的消息和通知（ClientSession 的 message_handler）"""
         try:
-            # 使用 incoming_messages 而不是 notifications
-            async for message in self.session.incoming_messages:
-                # 处理异常
-                if isinstance(message, Exception):
-                    print(f"收到错误消息: {message}")
-                    continue
+            # 处理异常
+            if isinstance(message, Exception):
+                print(f"收到错误消息: {message}")
+                return
+            
+            # 处理服务器通知
+            if isinstance(message, types.ServerNotification):
+                # 获取通知的根对象
+                notification = message.root
                 
-                # 处理服务器通知
-                if isinstance(message, types.ServerNotification):
-                    # 获取通知的根对象
-                    notification = message.root
-                    
-                    # 处理工具列表更新通知
-                    if isinstance(notification, types.ToolListChangedNotification):
-                        print("收到工具列表更新通知")
-                        # 重新获取工具列表
-                        response = await self.session.list_tools()
-                        self.tools = response.tools
-                        self.tools_updated = True
-                        print(f"MCP Server 的工具列表已更新: {[tool.name for tool in self.tools]}")
-                    
-                    # 处理资源更新通知
-                    elif isinstance(notification, types.ResourceUpdatedNotification):
-                        print(f"收到资源更新通知: {notification.params.uri}")
-                        # 这里可以添加资源更新的处理逻辑
-                    
-                    # 处理资源列表变更通知
-                    elif isinstance(notification, types.ResourceListChangedNotification):
-                        print("收到资源列表变更通知")
-                        # 这里可以添加资源列表更新的处理逻辑
-                    
-                    # 处理提示列表变更通知
-                    elif isinstance(notification, types.PromptListChangedNotification):
-                        print("收到提示列表变更通知")
-                        # 这里可以添加提示列表更新的处理逻辑
-                    
-                    # 处理进度通知
-                    elif isinstance(notification, types.ProgressNotification):
-                        print(f"收到进度通知: {notification.params.progressToken} - {notification.params.progress}/{notification.params.total}")
-                        # 这里可以添加进度更新的处理逻辑
-                    
-                    # 处理取消通知
-                    elif isinstance(notification, types.CancelledNotification):
-                        print(f"收到取消通知: 请求ID {notification.params.requestId}")
-                        # 这里可以添加请求取消的处理逻辑
-                    
-                    # 处理日志消息通知
-                    elif isinstance(notification, types.LoggingMessageNotification):
-                        print(f"收到日志消息: [{notification.params.level}] {notification.params.message}")
-                        # 这里可以添加日志处理的逻辑
-                    
-                    # 处理其他类型的通知
-                    else:
-                        print(f"收到未知类型的通知: {notification}")
+                # 处理工具列表更新通知
+                if isinstance(notification, types.ToolListChangedNotification):
+                    print("收到工具列表更新通知")
+                    # 这里在会话的接收循环中执行，不能等待 list_tools 的响应，改为在后台重新获取；
+                    # 还在进行的后台获取已经过期，先取消，避免用旧列表覆盖新列表
+                    if self._catalog_task is not None:
+                        self._catalog_task.cancel()
+                    self._catalog_task = asyncio.create_task(self._refresh_tools())
                 
-                # 处理服务器请求
-                elif hasattr(message, 'request') and hasattr(message, 'respond'):
-                    # 这是一个请求响应器 (RequestResponder)
-                    request = message.request.root
-                    print(f"收到服务器请求: {request}")
-                    
-                    # 处理创建消息请求
-                    if isinstance(request, types.CreateMessageRequest):
-                        print("收到创建消息请求")
-                        # 这里可以添加处理创建消息请求的逻辑
-                    
-                    # 处理列出根目录请求
-                    elif isinstance(request, types.ListRootsRequest):
-                        print("收到列出根目录请求")
-                        # 这里可以添加处理列出根目录请求的逻辑
-                    
-                    # 处理 Ping 请求
-                    elif isinstance(request, types.PingRequest):
-                        print("收到 Ping 请求")
-                        # 这里可以添加处理 Ping 请求的逻辑
-                    
-                    # 处理其他类型的请求
-                    else:
-                        print(f"收到未知类型的请求: {request}")
+                # 处理资源更新通知
+                elif isinstance(notification, types.ResourceUpdatedNotification):
+                    print(f"收到资源更新通知: {notification.params.uri}")
+                    # 这里可以添加资源更新的处理逻辑
+                
+                # 处理资源列表变更通知
+                elif isinstance(notification, types.ResourceListChangedNotification):
+                    print("收到资源列表变更通知")
+                    # 这里可以添加资源列表更新的处理逻辑
+                
+                # 处理提示列表变更通知
+                elif isinstance(notification, types.PromptListChangedNotification):
+                    print("收到提示列表变更通知")
+                    # 这里可以添加提示列表更新的处理逻辑
+                
+                # 处理进度通知
+                elif isinstance(notification, types.ProgressNotification):
+                    print(f"收到进度通知: {notification.params.progressToken} - {notification.params.progress}/{notification.params.total}")
+                    # 这里可以添加进度更新的处理逻辑
+                
+                # 处理取消通知
+                elif isinstance(notification, types.CancelledNotification):
+                    print(f"收到取消通知: 请求ID {notification.params.requestId}")
+                    # 这里可以添加请求取消的处理逻辑
+                
+                # 处理日志消息通知
+                elif isinstance(notification, types.LoggingMessageNotification):
+                    print(f"收到日志消息: [{notification.params.level}] {notification.params.message}")
+                    # 这里可以添加日志处理的逻辑
                 
-                # 处理其他类型的消息
+                # 处理其他类型的通知
                 else:
-                    print(f"收到未知类型的消息: {message}")
-        except asyncio.CancelledError:
-            print("mcp-client对MCP服务器的消息监听已停止")
+                    print(f"收到未知类型的通知: {notification}")
+            
+            # 处理服务器请求
+            elif hasattr(message, 'request') and hasattr(message, 'respond'):
+                # 这是一个请求响应器 (RequestResponder)
+                request = message.request.root
+                print(f"收到服务器请求: {request}")
+                
+                # 处理创建消息请求
+                if isinstance(request, types.CreateMessageRequest):
+                    print("收到创建消息请求")
+                    # 这里可以添加处理创建消息请求的逻辑
+                
+                # 处理列出根目录请求
+                elif isinstance(request, types.ListRootsRequest):
+                    print("收到列出根目录请求")
+                    # 这里可以添加处理列出根目录请求的逻辑
+                
+                # 处理 Ping 请求
+                elif isinstance(request, types.PingRequest):
+                    print("收到 Ping 请求")
+                    # 这里可以添加处理 Ping 请求的逻辑
+                
+                # 处理其他类型的请求
+                else:
+                    print(f"收到未知类型的请求: {request}")
+            
+            # 处理其他类型的消息
+            else:
+                print(f"收到未知类型的消息: {message}")
         except Exception as e:
-            print(f"mcp-client对MCP服务器的消息监听出错: {e}")
+            # 处理单条消息出错不影响会话继续接收后续消息
+            print(f"mcp-client处理MCP服务器消息出错: {e}")
+
+    def _fit_budget(self, query_usage: QueryUsage, tools: Optional[list] = None) -> dict:
+        """发送请求前检查 token 预算
 
-    async def process_query(self, query: str) -> str:
-        """Process a query using OpenAI and available tools"""
+        预计的 prompt tokens 加上为回复预留的 tokens 超出预算时，删除最早的几轮对话（当前这一轮除外）；
+        只有删除后确实能放进预算时才真正删除，否则不改动历史并拒绝请求。
+        返回需要额外传给 chat.completions.create 的参数（预留的 max_tokens）。
+        """
+        allowance = self.usage.allowance(query_usage)
+        if allowance is None:
+            return {}
+        reserve = self.usage.completion_reserve
+        messages = self.messages.materialize()
+        user_indexes = [i for i, message in enumerate(messages) if message["role"] == "user"]
+        # 候选的保留起点：不删除，或者从第 k 轮用户消息开始保留（至少保留当前这一轮）
+        starts = [1] + user_indexes[1:]
+        for start in starts:
+            estimate = estimate_tokens(messages[:1] + messages[start:], tools)
+            if estimate + reserve <= allowance:
+                if start > 1:
+                    del self.messages[1:start]
+                    if self._turn_start is not None:
+                        self._turn_start -= start - 1
+                    print(f"为满足 token 预算 {allowance}，已删除最早的对话，预计 {estimate} tokens")
+                return {"max_tokens": reserve}
+        raise BudgetExceeded(
+            f"estimated {estimate} prompt tokens plus {reserve} reserved completion tokens "
+            f"exceed the remaining budget of {max(allowance, 0)} tokens"
+        )
+
+    async def _call_tool(self, tool_name: str, tool_args: dict):
+        """调用工具；调用被取消时通知服务器同时取消这个请求"""
+        # call_tool 在第一次挂起之前就分配了请求 ID，所以此刻的 _request_id 就是这次调用的 ID
+        request_id = getattr(self.session, "_request_id", None)
+        try:
+            return await self.session.call_tool(tool_name, tool_args)
+        except asyncio.CancelledError:
+            self.cancelled["tool_calls"] += 1
+            if request_id is not None:
+                print(f"取消工具调用 {tool_name}: 请求ID {request_id}")
+                try:
+                    await self.session.send_notification(types.ClientNotification(
+                        types.CancelledNotification(
+                            method="notifications/cancelled",
+                            params=types.CancelledNotificationParams(
+                                requestId=request_id,
+                                reason="client deadline expired or query aborted",
+                            ),
+                        )
+                    ))
+                except Exception as e:
+                    print(f"发送取消通知失败: {e}")
+            raise
+
+    async def process_query(self, query: str, timeout: Optional[float] = None,
+                            abort: Optional[asyncio.Event] = None) -> QueryResult:
+        """Process a query using OpenAI and available tools
+
+        Args:
+            query: The user query
+            timeout: Deadline in seconds for the whole query
+            abort: Event that aborts the query when set
+
+        When the deadline expires or the query is aborted, the pending LLM HTTP request is
+        aborted, outstanding MCP tool calls are cancelled on the server, and the partial
+        turn is removed from the conversation history.
+        """
+        query_usage = self.usage.start_query()
+        self._turn_start = None
+        task = asyncio.ensure_future(self._process_query(query, query_usage))
+        abort_task = asyncio.ensure_future(abort.wait()) if abort is not None else None
+        try:
+            await asyncio.wait([t for t in (task, abort_task) if t], timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if abort_task is not None:
+                abort_task.cancel()
+            if not task.done():
+                # 取消进行中的 LLM 请求和工具调用，并等待取消通知发送完成
+                task.cancel()
+                await asyncio.wait([task])
+                if self._turn_start is not None:
+                    del self.messages[self._turn_start:]
+                self.cancelled["queries"] += 1
+
+        if not task.cancelled():
+            return task.result()
+        reason = "aborted" if abort is not None and abort.is_set() else f"timed out after {timeout}s"
+        print(f"查询已取消: {reason}")
+        return QueryResult(f"Query {reason}", query_usage)
+
+    async def _process_query(self, query: str, query_usage: QueryUsage) -> QueryResult:
         # 在新对话开始时检查是否需要更新系统提示词
         if self.tools_updated:
             print("需要对系统提示词进行更新")
@@ -190,12 +390,13 @@ class MCPClient:
         # Add user query to messages
         print(f"收到用户查询: {query}")
 
+        self._turn_start = len(self.messages)
         self.messages.append({
             "role": "user",
             "content": query
         })
 
-        print(f"将用户查询添加到对话历史: {self.messages}")
+        print(f"将用户查询添加到对话历史，共 {len(self.messages)} 条消息")
 
         # Prepare tools for OpenAI
         available_tools = [{
@@ -209,17 +410,28 @@ class MCPClient:
 
         print(f"按照OPENAI API的格式准备工具列表: {[tool['function']['name'] for tool in available_tools]}")
 
+        try:
+            budget_args = self._fit_budget(query_usage, available_tools)
+        except BudgetExceeded as e:
+            # 拒绝本次查询，不把它留在对话历史中
+            del self.messages[self._turn_start:]
+            print(f"超出 token 预算，拒绝查询: {e}")
+            return QueryResult(f"Query refused: {e}", query_usage)
+
         try:
             # Initial OpenAI API call
             print(f"发送请求到 OpenAI API...")
+            started = time.perf_counter()
             response = await self.openai.chat.completions.create(
                 model="deepseek-chat",
-                messages=self.messages,
+                messages=self.messages.materialize(),
                 tools=available_tools,
-                tool_choice="auto"
+                tool_choice="auto",
+                **budget_args
             )
             print(f"收到 OpenAI API 响应")
             message = response.choices[0].message
+            self.usage.record(query_usage, "tools", response.usage, started)
             # Add assistant's response to history (only content and tool_calls)
             print(f"AI 响应内容: {message.content}")
             assistant_message = {
@@ -240,61 +452,120 @@ class MCPClient:
                 ]
                 print(f"将工具调用添加到对话历史: {assistant_message}")
             self.messages.append(assistant_message)
-            print(f"将助手的响应添加到对话历史: {self.messages}")
+            print(f"将助手的响应添加到对话历史，共 {len(self.messages)} 条消息")
             # If no tool calls, return the response directly
             if not message.tool_calls:
                 print(f"没有工具调用，直接返回响应: {message.content}")
-                return message.content or ""
+                return QueryResult(message.content or "", query_usage)
 
             final_text = [message.content] if message.content else []
             print(f"最终响应内容: {final_text}")
             # Handle tool calls
+            # 先在本地校验所有工具调用的参数
+            pending_calls = []
             for tool_call in message.tool_calls:
+                print('处理工具调用')
+                tool_name = tool_call.function.name
                 try:
-                    print('处理工具调用')
-                    tool_name = tool_call.function.name
-                    tool_args = json.loads(tool_call.function.arguments)
-                    print(f"工具名称：{tool_name} , 工具参数：{tool_args}")
-                    # Execute tool call
-                    result = await self.session.call_tool(tool_name, tool_args)
-                    print(f"工具调用结果: {result.content}")
-                    # Add tool result to conversation
+                    tool_args = self.validators.validate(
+                        tool_name, json.loads(tool_call.function.arguments or "{}")
+                    )
+                except json.JSONDecodeError as e:
+                    error = f"arguments are not valid JSON ({e})"
+                except ToolArgumentError as e:
+                    error = "; ".join(e.errors)
+                else:
+                    error = None
+                if error is not None:
+                    # 参数不合法时不调用 MCP Server，直接把错误作为工具结果反馈给模型
+                    error_msg = f"Invalid arguments for tool {tool_name}: {error}"
+                    print(f"工具参数校验失败: {error_msg}")
                     self.messages.append({
                         "role": "tool",
                         "tool_call_id": tool_call.id,
                         "name": tool_name,
-                        "content": str(result.content)  # Ensure content is string
+                        "content": error_msg
+                    })
+                    final_text.append(f"\n[Error: {error_msg}]\n")
+                    continue
+                print(f"工具名称：{tool_name} , 工具参数：{tool_args}")
+                pending_calls.append((tool_call, tool_name, tool_args))
+
+            # 并发执行工具调用，相同的调用（本轮重复或其它对话正在进行的）只发送一次
+            results = await asyncio.gather(*[
+                self.inflight.run(
+                    tool_name, tool_args,
+                    lambda tool_name=tool_name, tool_args=tool_args: self._call_tool(tool_name, tool_args)
+                )
+                for _, tool_name, tool_args in pending_calls
+            ], return_exceptions=True)
+
+            for (tool_call, tool_name, _), result in zip(pending_calls, results):
+                # gather 返回的 CancelledError 不是 Exception 的子类
+                if isinstance(result, BaseException):
+                    error_msg = f"Error executing tool {tool_name}: {str(result) or type(result).__name__}"
+                    # 每个 tool_call 都必须有对应的 tool 消息，否则下一次请求会被 API 拒绝
+                    self.messages.append({
+                        "role": "tool",
+                        "tool_call_id": tool_call.id,
+                        "name": tool_name,
+                        "content": error_msg
                     })
-                    print(f"将工具调用结果添加到对话历史: {self.messages}")
-                    final_text.append(f"\n[Tool {tool_name} result: {result.content}]\n")
-                except Exception as e:
-                    error_msg = f"Error executing tool {tool_name}: {str(e)}"
                     final_text.append(f"\n[Error: {error_msg}]\n")
                     continue
+                print(f"工具调用结果: {result.content}")
+                # Add tool result to conversation
+                content = str(result.content)  # Ensure content is string
+                self.messages.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call.id,
+                    "name": tool_name,
+                    "content": content
+                })
+                self.usage.record_tool(query_usage, tool_name, content)
+                print(f"将工具调用结果添加到对话历史，共 {len(self.messages)} 条消息")
+                final_text.append(f"\n[Tool {tool_name} result: {result.content}]\n")
+            print(f"工具调用合并统计: {self.inflight.stats()}")
 
             # Get final response from OpenAI
+            try:
+                budget_args = self._fit_budget(query_usage)
+            except BudgetExceeded as e:
+                # 与首次请求一样不把这一轮留在对话历史中，但仍把已经拿到的工具结果返回给用户
+                del self.messages[self._turn_start:]
+                print(f"超出 token 预算，无法生成最终回复: {e}")
+                final_text.append(f"\nQuery refused: {e}")
+                return QueryResult("\n".join(filter(None, final_text)), query_usage)
             print(f"发送请求到 OpenAI API...")
+            started = time.perf_counter()
             response = await self.openai.chat.completions.create(
                 model="deepseek-chat",
-                messages=self.messages
+                messages=self.messages.materialize(),
+                **budget_args
             )
             print(f"收到 OpenAI API 响应")
+            self.usage.record(query_usage, "final", response.usage, started,
+                              [tool_name for _, tool_name, _ in pending_calls])
             final_message = response.choices[0].message
             self.messages.append({
                 "role": "assistant",
                 "content": final_message.content or ""
             })
-            print(f"将助手的响应添加到对话历史: {self.messages}")
+            print(f"将助手的响应添加到对话历史，共 {len(self.messages)} 条消息")
             final_text.append(final_message.content)
 
-            return "\n".join(filter(None, final_text))
+            return QueryResult("\n".join(filter(None, final_text)), query_usage)
 
         except Exception as e:
-            print(f"Debug - Messages: {json.dumps(self.messages, ensure_ascii=False, indent=2)}")
-            return f"Error processing query: {str(e)}"
+            print(f"Debug - Messages: {json.dumps(self.messages.materialize(), ensure_ascii=False, indent=2)}")
+            return QueryResult(f"Error processing query: {str(e)}", query_usage)
+
+    async def chat_loop(self, timeout: Optional[float] = None):
+        """Run an interactive chat loop
 
-    async def chat_loop(self):
-        """Run an interactive chat loop"""
+        Args:
+            timeout: Deadline in seconds for each query
+        """
         print("\nMCP Client Started!")
         print("Type your queries or 'quit' to exit.")
         
@@ -306,8 +577,9 @@ class MCPClient:
                     print("用户请求退出")
                     break
                     
-                response = await self.process_query(query)
+                response = await self.process_query(query, timeout)
                 print("最终响应:\n" + response)
+                print(f"本次查询 token 用量: {response.usage.total.as_dict()}")
                     
             except Exception as e:
                 print(f"\nError: {str(e)}")
@@ -315,27 +587,43 @@ class MCPClient:
     async def cleanup(self):
         """Clean up resources"""
         print("清理资源")
-        if self._notification_task:
-            self._notification_task.cancel()
+        if self._catalog_task:
+            self._catalog_task.cancel()
             try:
-                await self._notification_task
+                await self._catalog_task
             except asyncio.CancelledError:
                 pass
         await self.exit_stack.aclose()
+        if self.cassette is not None:
+            self.cassette.close()
+        print(f"会话 token 用量汇总: {json.dumps(self.usage.report(), ensure_ascii=False)}")
+        # 释放对话历史在共享缓冲区中的内容
+        self.messages.clear()
         print("资源清理完成")
 async def main():
     print("交互式聊天程序启动")
-    if len(sys.argv) < 2:
-        print("Usage: python client.py <path_to_server_script>")
+    parser = argparse.ArgumentParser(description="MCP client")
+    parser.add_argument("server_script", nargs="?", help="path to the server script (.py or .js)")
+    parser.add_argument("--record", metavar="FILE", help="record LLM and MCP traffic to FILE (.jsonl or .jsonl.gz)")
+    parser.add_argument("--replay", metavar="FILE", help="replay a recorded FILE instead of using DeepSeek and the server")
+    parser.add_argument("--speed", type=float, default=0.0, help="replay speed, 1 = recorded speed, 0 = as fast as possible")
+    parser.add_argument("--timeout", type=float, default=None, help="deadline in seconds for each query")
+    args = parser.parse_args()
+    if not args.server_script and not args.replay:
+        print("Usage: python client.py <path_to_server_script> [--record FILE] | --replay FILE [--speed N]")
         sys.exit(1)
     
     client = MCPClient()
     try:
-        await client.connect_to_server(sys.argv[1])
-        await client.chat_loop()
+        if args.replay:
+            await client.connect_replay(Cassette.load(args.replay), args.speed)
+        else:
+            await client.connect_to_server(args.server_script, Cassette(args.record) if args.record else None)
+        await client.chat_loop(args.timeout)
     finally:
         await client.cleanup()
 
 if __name__ == "__main__":
     import sys
+    import argparse
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""相同工具调用的合并（singleflight）
+
+同一轮里重复的 tool_calls，或者多个并发对话同时发起的相同调用
+（例如都在调用 get_alerts(state="CA")），只向 MCP Server 发送一次 call_tool，
+其余调用等待同一个结果。以工具名加规范化后的参数作为 key。
+
+非幂等的工具（每次调用都有副作用）可以通过 no_dedup 关闭合并。
+"""
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+
+def call_key(tool_name: str, arguments: Any) -> str:
+    """工具名 + 规范化参数，作为合并调用的 key"""
+    return tool_name + ":" + json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class InflightCalls:
+    """正在进行中的工具调用登记表"""
+
+    def __init__(self, no_dedup: Optional[Iterable[str]] = None):
+        # 不参与合并的工具名
+        self.no_dedup = set(no_dedup or ())
+        self._pending: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        self.calls = 0    # 收到的调用次数
+        self.shared = 0   # 合并到已有调用上的次数
+
+    @property
+    def dedup_ratio(self) -> float:
+        """被合并掉的调用占比"""
+        return self.shared / self.calls if self.calls else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "upstream": self.calls - self.shared,
+            "dedup_ratio": round(self.dedup_ratio, 3),
+        }
+
+    async def run(self, tool_name: str, arguments: Any, call: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 call()；相同 key 的调用还在进行中时直接等待它的结果"""
+        self.calls += 1
+        if tool_name in self.no_dedup:
+            return await call()
+
+        key = call_key(tool_name, arguments)
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._pending[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+        else:
+            self.shared += 1
+
+        self._waiters[key] += 1
+        try:
+            # shield: 某个等待方被取消时不影响其它等待方
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 所有等待方都放弃了，才真正取消底层调用
+            if not task.done() and self._pending.get(key) is task and self._waiters[key] == 1:
+                # 先移出登记表：取消期间到达的相同调用会重新发起，而不是等待一个正在取消的调用
+                del self._pending[key]
+                del self._waiters[key]
+                task.cancel()
+                # 等待底层调用完成取消（例如向服务器发送取消通知）
+                await asyncio.wait([task])
+            raise
+        finally:
+            if key in self._waiters and self._pending.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+            del self._waiters[key]
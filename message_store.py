@@ -0,0 +1,177 @@
+"""紧凑的对话历史存储
+
+默认的对话历史是一个 dict 列表，每条消息都重复保存 "role"、"content" 等 key，
+工具结果也以完整字符串保存在每个会话里。同一个进程里保存大量对话时内存增长很快。
+
+这里用 __slots__ 记录代替 dict，role 和工具名做 intern，超过阈值的大段内容
+（工具结果、系统提示词等）按内容哈希只在共享的 ContentBuffer 里保存一份。
+只有在请求 OpenAI API 时才通过 materialize() 生成 messages 列表。
+"""
+import hashlib
+import sys
+import weakref
+from typing import Any, Iterator, Optional
+
+# 超过这个长度（字符数）的内容放进共享缓冲区
+INLINE_LIMIT = 256
+
+
+class ContentBuffer:
+    """按内容寻址的共享存储，相同内容只保存一份，按引用计数释放"""
+
+    __slots__ = ("_data", "_refs")
+
+    def __init__(self):
+        self._data: dict[bytes, str] = {}
+        self._refs: dict[bytes, int] = {}
+
+    def put(self, content: str) -> bytes:
+        key = hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        if key in self._data:
+            self._refs[key] += 1
+        else:
+            self._data[key] = content
+            self._refs[key] = 1
+        return key
+
+    def get(self, key: bytes) -> str:
+        return self._data[key]
+
+    def release(self, key: bytes) -> None:
+        self._refs[key] -= 1
+        if not self._refs[key]:
+            del self._refs[key]
+            del self._data[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def nbytes(self) -> int:
+        """缓冲区中内容的大致字节数"""
+        return sum(sys.getsizeof(content) for content in self._data.values())
+
+
+# 进程内所有会话默认共享同一个缓冲区
+shared_buffer = ContentBuffer()
+
+
+class ContentRef:
+    """指向 ContentBuffer 中一段内容的引用"""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: bytes):
+        self.key = key
+
+
+class ToolCall:
+    __slots__ = ("id", "name", "arguments")
+
+    def __init__(self, id: str, name: str, arguments: str):
+        self.id = id
+        self.name = sys.intern(name)
+        self.arguments = arguments
+
+
+class Message:
+    __slots__ = ("role", "content", "tool_call_id", "name", "tool_calls")
+
+    def __init__(self, role: str, content: Any, tool_call_id: Optional[str] = None,
+                 name: Optional[str] = None, tool_calls: Optional[tuple] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tool_call_id = tool_call_id
+        self.name = sys.intern(name) if name is not None else None
+        self.tool_calls = tool_calls
+
+
+def _release_records(buffer: ContentBuffer, records: list) -> None:
+    """MessageStore 被回收时释放它在缓冲区中引用的内容"""
+    for record in records:
+        if isinstance(record.content, ContentRef):
+            buffer.release(record.content.key)
+    records.clear()
+
+
+class MessageStore:
+    """单个会话的对话历史
+
+    支持 append / 下标读写 / len / 迭代，读取时返回与 OpenAI API 一致的 dict，
+    因此可以直接替换原来的 messages 列表。没有调用 clear() 就被回收时，
+    也会释放共享缓冲区中的内容。
+    """
+
+    __slots__ = ("_records", "_buffer", "__weakref__")
+
+    def __init__(self, buffer: Optional[ContentBuffer] = None):
+        self._records: list[Message] = []
+        self._buffer = buffer if buffer is not None else shared_buffer
+        # 回调只引用记录列表和缓冲区，不引用 self
+        finalizer = weakref.finalize(self, _release_records, self._buffer, self._records)
+        finalizer.atexit = False
+
+    def _pack(self, message: dict) -> Message:
+        content = message.get("content")
+        if isinstance(content, str) and len(content) > INLINE_LIMIT:
+            content = ContentRef(self._buffer.put(content))
+        tool_calls = message.get("tool_calls")
+        if tool_calls:
+            tool_calls = tuple(
+                ToolCall(call["id"], call["function"]["name"], call["function"]["arguments"])
+                for call in tool_calls
+            )
+        return Message(message["role"], content, message.get("tool_call_id"), message.get("name"), tool_calls)
+
+    def _unpack(self, record: Message) -> dict:
+        content = record.content
+        if isinstance(content, ContentRef):
+            content = self._buffer.get(content.key)
+        message = {"role": record.role, "content": content}
+        if record.tool_call_id is not None:
+            message["tool_call_id"] = record.tool_call_id
+        if record.name is not None:
+            message["name"] = record.name
+        if record.tool_calls:
+            message["tool_calls"] = [
+                {"id": call.id, "type": "function", "function": {"name": call.name, "arguments": call.arguments}}
+                for call in record.tool_calls
+            ]
+        return message
+
+    def _release(self, record: Message) -> None:
+        if isinstance(record.content, ContentRef):
+            self._buffer.release(record.content.key)
+
+    def append(self, message: dict) -> None:
+        self._records.append(self._pack(message))
+
+    def __getitem__(self, index: int) -> dict:
+        return self._unpack(self._records[index])
+
+    def __setitem__(self, index: int, message: dict) -> None:
+        record = self._pack(message)
+        self._release(self._records[index])
+        self._records[index] = record
+
+    def __delitem__(self, index) -> None:
+        removed = self._records[index] if isinstance(index, slice) else [self._records[index]]
+        for record in removed:
+            self._release(record)
+        del self._records[index]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self._unpack(record) for record in self._records)
+
+    def __repr__(self) -> str:
+        # 不调用 materialize()：打印日志时不应该把每条记录和缓冲区内容都还原一遍
+        return f"<MessageStore: {len(self._records)} messages>"
+
+    def clear(self) -> None:
+        _release_records(self._buffer, self._records)
+
+    def materialize(self) -> list[dict]:
+        """生成发送给 OpenAI API 的 messages 列表"""
+        return [self._unpack(record) for record in self._records]
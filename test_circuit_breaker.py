@@ -0,0 +1,101 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import BREAKER_MIN_REQUESTS, BREAKER_OPEN_SECONDS, CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def trip(breaker):
+    for _ in range(BREAKER_MIN_REQUESTS):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "open"
+
+
+def test_stays_closed_below_minimum_requests(clock):
+    breaker = CircuitBreaker("api/alerts")
+    for _ in range(BREAKER_MIN_REQUESTS - 1):
+        breaker.record(False)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_stays_closed_below_failure_rate(clock):
+    breaker = CircuitBreaker("api/alerts")
+    for success in [True, True, False, True, False, True]:
+        breaker.record(success)
+    assert breaker.state == "closed"
+
+
+def test_open_fails_fast_until_open_seconds_pass(clock):
+    breaker = CircuitBreaker("api/alerts")
+    trip(breaker)
+    assert not breaker.allow()
+    clock.now += BREAKER_OPEN_SECONDS / 2
+    assert not breaker.allow()
+    assert breaker.retry_in() == pytest.approx(BREAKER_OPEN_SECONDS / 2)
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker("api/alerts")
+    trip(breaker)
+    clock.now += BREAKER_OPEN_SECONDS
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # 只放行一个探测请求
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    # 关闭后重新统计失败率
+    for _ in range(BREAKER_MIN_REQUESTS - 1):
+        breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker("api/alerts")
+    trip(breaker)
+    clock.now += BREAKER_OPEN_SECONDS
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opened_at == clock.now
+    assert not breaker.allow()
+
+
+def test_abandoned_probe_lets_another_probe_through(clock):
+    breaker = CircuitBreaker("api/alerts")
+    trip(breaker)
+    clock.now += BREAKER_OPEN_SECONDS
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.allow()
+
+
+def test_outcomes_while_open_are_ignored(clock):
+    breaker = CircuitBreaker("api/alerts")
+    trip(breaker)
+    opened_at = breaker.opened_at
+    clock.now += 10
+    # 熔断前已经发出的请求陆续返回
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == "open"
+    assert breaker.opened_at == opened_at
+    clock.now = opened_at + BREAKER_OPEN_SECONDS
+    assert breaker.allow()
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from inflight import InflightCalls, call_key
+
+
+class Upstream:
+    """记录调用次数的假工具调用，release 之前一直挂起"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def call(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"result {self.calls}"
+
+
+def test_call_key_ignores_argument_order():
+    assert call_key("get_alerts", {"a": 1, "b": 2}) == call_key("get_alerts", {"b": 2, "a": 1})
+    assert call_key("get_alerts", {"a": 1}) != call_key("get_forecast", {"a": 1})
+
+
+def test_identical_calls_share_one_upstream_call():
+    async def main():
+        inflight = InflightCalls()
+        upstream = Upstream()
+        tasks = [asyncio.ensure_future(inflight.run("get_alerts", {"state": "CA"}, upstream.call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*tasks)
+        assert results == ["result 1"] * 3
+        assert upstream.calls == 1
+        assert inflight.stats() == {"calls": 3, "shared": 2, "upstream": 1, "dedup_ratio": 0.667}
+        assert inflight._pending == {} and inflight._waiters == {}
+    asyncio.run(main())
+
+
+def test_no_dedup_tools_always_call_upstream():
+    async def main():
+        inflight = InflightCalls(no_dedup={"send_email"})
+        upstream = Upstream()
+        upstream.release.set()
+        await asyncio.gather(*[inflight.run("send_email", {"to": "a"}, upstream.call) for _ in range(2)])
+        assert upstream.calls == 2
+        assert inflight.shared == 0
+    asyncio.run(main())
+
+
+def test_errors_are_shared_and_not_cached():
+    async def main():
+        inflight = InflightCalls()
+        attempts = []
+
+        async def failing():
+            attempts.append(1)
+            await asyncio.sleep(0)
+            raise RuntimeError("server error")
+
+        results = await asyncio.gather(*[inflight.run("t", {}, failing) for _ in range(2)], return_exceptions=True)
+        assert [str(r) for r in results] == ["server error"] * 2
+        assert len(attempts) == 1
+        # 失败的调用已经移出登记表，下一次调用会重新发起
+        await asyncio.gather(inflight.run("t", {}, failing), return_exceptions=True)
+        assert len(attempts) == 2
+    asyncio.run(main())
+
+
+def test_cancelling_one_waiter_keeps_the_shared_call():
+    async def main():
+        inflight = InflightCalls()
+        upstream = Upstream()
+        first = asyncio.ensure_future(inflight.run("t", {}, upstream.call))
+        second = asyncio.ensure_future(inflight.run("t", {}, upstream.call))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.wait([first])
+        assert first.cancelled()
+        upstream.release.set()
+        assert await second == "result 1"
+        assert upstream.cancelled == 0
+    asyncio.run(main())
+
+
+def test_cancelling_the_last_waiter_cancels_the_upstream_call():
+    async def main():
+        inflight = InflightCalls()
+        upstream = Upstream()
+        waiters = [asyncio.ensure_future(inflight.run("t", {}, upstream.call)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.wait(waiters)
+        assert upstream.cancelled == 1
+        assert inflight._pending == {} and inflight._waiters == {}
+    asyncio.run(main())
+
+
+def test_call_arriving_while_cancelling_starts_a_fresh_call():
+    async def main():
+        inflight = InflightCalls()
+        cancelling = asyncio.Event()
+        finish_cancel = asyncio.Event()
+        calls = []
+
+        async def slow_to_cancel():
+            calls.append(1)
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                # 例如向服务器发送取消通知
+                cancelling.set()
+                await finish_cancel.wait()
+                raise
+
+        async def fresh():
+            calls.append(2)
+            return "fresh"
+
+        waiter = asyncio.ensure_future(inflight.run("t", {}, slow_to_cancel))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await cancelling.wait()
+        # 旧调用还在取消中，相同的新调用不能等待它
+        assert await inflight.run("t", {}, fresh) == "fresh"
+        finish_cancel.set()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert calls == [1, 2]
+        assert inflight._pending == {} and inflight._waiters == {}
+    asyncio.run(main())
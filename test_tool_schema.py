@@ -0,0 +1,137 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from tool_schema import ToolArgumentError, ToolValidators, _compile
+
+
+def check(schema, value):
+    errors = []
+    result = _compile(schema)(value, "$", errors)
+    return result, errors
+
+
+def tool(name, schema):
+    return SimpleNamespace(name=name, inputSchema=schema)
+
+
+@pytest.mark.parametrize("schema, value, expected", [
+    ({"type": "number"}, "40.7", 40.7),
+    ({"type": "integer"}, "3", 3),
+    ({"type": "integer"}, 3.0, 3),
+    ({"type": "boolean"}, "True", True),
+    ({"type": "string"}, 12, "12"),
+    ({"type": "array"}, (1, 2), [1, 2]),
+    # 值本身已经满足某个类型时不做转换
+    ({"type": ["string", "number"]}, "1", "1"),
+])
+def test_coercion(schema, value, expected):
+    result, errors = check(schema, value)
+    assert errors == []
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+@pytest.mark.parametrize("schema, value", [
+    ({"type": "integer"}, "1.5"),
+    ({"type": "integer"}, True),
+    ({"type": "number"}, "abc"),
+    ({"type": "boolean"}, "yes"),
+])
+def test_coercion_failure(schema, value):
+    _, errors = check(schema, value)
+    assert len(errors) == 1
+
+
+@pytest.mark.parametrize("value", [math.nan, math.inf, "nan", "-Infinity"])
+@pytest.mark.parametrize("type_name", ["number", "integer"])
+def test_non_finite_numbers_rejected(type_name, value):
+    _, errors = check({"type": type_name}, value)
+    assert errors
+
+
+def test_object_required_default_and_additional_properties():
+    schema = {
+        "type": "object",
+        "properties": {
+            "state": {"type": "string"},
+            "limit": {"type": "integer", "default": 5},
+        },
+        "required": ["state", "limit"],
+        "additionalProperties": False,
+    }
+    result, errors = check(schema, {"state": "CA"})
+    assert errors == []
+    assert result == {"state": "CA"}
+
+    _, errors = check(schema, {"limit": "2", "extra": 1})
+    assert errors == ["$.state: required property is missing", "$.extra: unexpected property"]
+
+
+def test_local_ref_and_recursion():
+    schema = {
+        "type": "object",
+        "properties": {"root": {"$ref": "#/$defs/Node"}},
+        "$defs": {
+            "Node": {
+                "type": "object",
+                "properties": {
+                    "value": {"type": "number"},
+                    "children": {"type": "array", "items": {"$ref": "#/$defs/Node"}},
+                },
+                "required": ["value"],
+            },
+        },
+    }
+    tree = {"root": {"value": "1", "children": [{"value": 2, "children": [{"value": "3.5"}]}]}}
+    result, errors = check(schema, tree)
+    assert errors == []
+    assert result == {"root": {"value": 1.0, "children": [{"value": 2, "children": [{"value": 3.5}]}]}}
+
+    _, errors = check(schema, {"root": {"children": [{"value": "x"}]}})
+    assert errors == [
+        "$.root.value: required property is missing",
+        "$.root.children[0].value: expected number, got str",
+    ]
+
+
+def test_unresolvable_ref_accepts_anything():
+    result, errors = check({"$ref": "https://example.com/schema.json"}, {"a": 1})
+    assert errors == []
+    assert result == {"a": 1}
+
+
+def test_one_of_requires_exactly_one_match():
+    schema = {"oneOf": [{"type": "integer"}, {"type": "number", "minimum": 10}]}
+    assert check(schema, 3) == (3, [])
+    assert check(schema, 10.5) == (10.5, [])
+
+    _, errors = check(schema, 12)
+    assert errors == ["$: matches 2 schemas in oneOf, expected exactly one"]
+
+    _, errors = check(schema, "x")
+    assert errors[0].startswith("$: does not match any schema in oneOf")
+
+
+def test_any_of_accepts_first_match():
+    schema = {"anyOf": [{"type": "integer"}, {"type": "number", "minimum": 10}]}
+    assert check(schema, 12) == (12, [])
+    _, errors = check(schema, {})
+    assert errors[0].startswith("$: does not match any schema in anyOf")
+
+
+def test_validators_share_compiled_schema():
+    schema = {"type": "object", "properties": {"state": {"type": "string"}}, "required": ["state"]}
+    validators = ToolValidators()
+    validators.load([tool("a", schema), tool("b", dict(schema))])
+    assert validators._by_tool["a"] is validators._by_tool["b"]
+
+    assert validators.validate("a", {"state": "CA"}) == {"state": "CA"}
+    with pytest.raises(ToolArgumentError) as excinfo:
+        validators.validate("a", {})
+    assert excinfo.value.errors == ["$.state: required property is missing"]
+    with pytest.raises(ToolArgumentError, match="unknown tool c"):
+        validators.validate("c", {})
+    with pytest.raises(ToolArgumentError, match="must be a JSON object"):
+        validators.validate("a", ["CA"])
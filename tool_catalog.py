@@ -0,0 +1,83 @@
+"""工具列表的分页获取与本地快照
+
+list_tools 按 nextCursor 逐页获取，每拿到一页就可以开始使用；完整的工具列表保存为
+本地快照（按 server 启动命令和版本区分），下次连接时先直接使用快照，
+再在后台与 server 的最新列表对齐。
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from mcp import types
+
+# 快照目录，可通过环境变量 MCP_TOOL_CACHE_DIR 修改
+SNAPSHOT_DIR = Path(os.environ.get("MCP_TOOL_CACHE_DIR", Path.home() / ".cache" / "mcp_client" / "tools"))
+
+
+async def iter_tool_pages(session) -> AsyncIterator[list[types.Tool]]:
+    """按 nextCursor 逐页获取工具列表（使用 requirements.txt 中固定的 mcp 版本的 params 分页接口）"""
+    cursor = None
+    while True:
+        if cursor:
+            response = await session.list_tools(params=types.PaginatedRequestParams(cursor=cursor))
+        else:
+            response = await session.list_tools()
+        yield response.tools
+        cursor = response.nextCursor
+        if not cursor:
+            break
+
+
+async def fetch_all_tools(session) -> list[types.Tool]:
+    """获取完整的工具列表"""
+    tools = []
+    async for page in iter_tool_pages(session):
+        tools.extend(page)
+    return tools
+
+
+def snapshot_key(command: str, args: list[str], server_info: Optional[types.Implementation]) -> str:
+    """server 启动命令 + server 名称和版本
+
+    参数中的脚本路径转成绝对路径，从不同工作目录启动的不同脚本不会共用同一个快照。
+    """
+    name = server_info.name if server_info else ""
+    version = server_info.version if server_info else ""
+    args = [os.path.abspath(arg) if os.path.isfile(arg) else arg for arg in args]
+    return json.dumps([command, args, name, version])
+
+
+def _snapshot_path(key: str) -> Path:
+    return SNAPSHOT_DIR / (hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+
+def load_snapshot(key: str) -> Optional[list[types.Tool]]:
+    """读取工具列表快照，不存在或无法解析时返回 None"""
+    try:
+        with open(_snapshot_path(key), encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("key") != key:
+            return None
+        return [types.Tool.model_validate(tool) for tool in data["tools"]]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_snapshot(key: str, tools: list[types.Tool]) -> None:
+    """保存工具列表快照（先写临时文件再替换，避免写到一半的文件被读取）"""
+    path = _snapshot_path(key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "tools": [tool.model_dump(mode="json") for tool in tools]}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"保存工具列表快照失败: {e}")
+
+
+def same_tools(left: list[types.Tool], right: list[types.Tool]) -> bool:
+    """两个工具列表是否完全相同"""
+    return [tool.model_dump(mode="json") for tool in left] == [tool.model_dump(mode="json") for tool in right]
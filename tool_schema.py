@@ -0,0 +1,332 @@
+"""工具参数的 JSON Schema 校验
+
+在工具列表加载或刷新时，把每个工具的 inputSchema 编译成一个校验函数并缓存，
+调用 session.call_tool 之前先在本地校验参数，避免把错误参数发到 MCP Server
+白白浪费一次 stdio 往返。校验时会顺带做一些廉价的类型转换，例如把字符串
+"40.7" 转成浮点数。
+
+只实现了 MCP Server 常见的 JSON Schema 子集：
+type / properties / required / additionalProperties / items / enum / const /
+anyOf / oneOf / allOf / minimum / maximum / minLength / maxLength / default，
+以及指向本 schema 内 $defs / definitions 的 $ref（FastMCP 对 pydantic 模型参数会生成这种引用）。
+不认识的关键字和外部 $ref 不做校验。
+"""
+import hashlib
+import json
+import math
+from typing import Any, Callable, Optional
+
+
+class ToolArgumentError(ValueError):
+    """工具参数不符合 inputSchema"""
+
+    def __init__(self, tool_name: str, errors: list[str]):
+        self.tool_name = tool_name
+        self.errors = errors
+        super().__init__(f"Invalid arguments for tool {tool_name}: " + "; ".join(errors))
+
+
+# 校验函数: (value, path, errors) -> 转换后的 value；出错时向 errors 追加描述
+Validator = Callable[[Any, str, list], Any]
+
+_MISSING = object()
+
+
+def _coerce(value: Any, type_name: str) -> Any:
+    """尝试把 value 转成 type_name 对应的类型，失败返回 _MISSING"""
+    if type_name == "string":
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+    elif type_name == "number":
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            return value
+        if isinstance(value, str):
+            try:
+                number = float(value.strip())
+            except ValueError:
+                pass
+            else:
+                # "nan" / "inf" 不是合法的 JSON 数字
+                if math.isfinite(number):
+                    return number
+    elif type_name == "integer":
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, float) and math.isfinite(value) and value.is_integer():
+            return int(value)
+        if isinstance(value, str):
+            try:
+                number = float(value.strip())
+            except ValueError:
+                pass
+            else:
+                if math.isfinite(number) and number.is_integer():
+                    return int(number)
+    elif type_name == "boolean":
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+            return value.strip().lower() == "true"
+    elif type_name == "null":
+        if value is None:
+            return None
+    elif type_name == "object":
+        if isinstance(value, dict):
+            return value
+    elif type_name == "array":
+        if isinstance(value, list):
+            return value
+        if isinstance(value, tuple):
+            return list(value)
+    return _MISSING
+
+
+def _is_exact_type(value: Any, type_name: str) -> bool:
+    """不做转换时 value 是否已经是 type_name 类型"""
+    if type_name == "string":
+        return isinstance(value, str)
+    if type_name == "number":
+        # json.loads 也接受 NaN / Infinity，这里一并拒绝
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+    if type_name == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if type_name == "boolean":
+        return isinstance(value, bool)
+    if type_name == "null":
+        return value is None
+    if type_name == "object":
+        return isinstance(value, dict)
+    if type_name == "array":
+        return isinstance(value, list)
+    return True
+
+
+def _compile_type(types_: list[str]) -> Validator:
+    def check(value, path, errors):
+        # 值本身已经满足某个类型时不做转换，避免把 "1" 误转成数字
+        for type_name in types_:
+            if _is_exact_type(value, type_name):
+                return value
+        for type_name in types_:
+            coerced = _coerce(value, type_name)
+            if coerced is not _MISSING:
+                return coerced
+        errors.append(f"{path}: expected {' or '.join(types_)}, got {type(value).__name__}")
+        return value
+    return check
+
+
+def _compile_any_of(subschemas: list[Validator]) -> Validator:
+    def check(value, path, errors):
+        collected = []
+        for validator in subschemas:
+            sub_errors: list[str] = []
+            result = validator(value, path, sub_errors)
+            if not sub_errors:
+                return result
+            collected.extend(sub_errors)
+        errors.append(f"{path}: does not match any schema in anyOf ({'; '.join(collected)})")
+        return value
+    return check
+
+
+def _compile_one_of(subschemas: list[Validator]) -> Validator:
+    def check(value, path, errors):
+        collected = []
+        matches = []
+        for validator in subschemas:
+            sub_errors: list[str] = []
+            result = validator(value, path, sub_errors)
+            if sub_errors:
+                collected.extend(sub_errors)
+            else:
+                matches.append(result)
+        if len(matches) == 1:
+            return matches[0]
+        if matches:
+            errors.append(f"{path}: matches {len(matches)} schemas in oneOf, expected exactly one")
+        else:
+            errors.append(f"{path}: does not match any schema in oneOf ({'; '.join(collected)})")
+        return value
+    return check
+
+
+def _resolve_ref(ref: str, root: dict) -> Any:
+    """解析 "#/$defs/Name" 形式的本地引用，无法解析时返回 None"""
+    if not ref.startswith("#"):
+        return None
+    target: Any = root
+    for part in ref[1:].split("/"):
+        if not part:
+            continue
+        part = part.replace("~1", "/").replace("~0", "~")
+        if not isinstance(target, dict) or part not in target:
+            return None
+        target = target[part]
+    return target
+
+
+def _compile(schema: Any, root: Any = None, refs: Optional[dict] = None) -> Validator:
+    if root is None:
+        root = schema
+    if refs is None:
+        # 已编译的 $ref，同时用来处理递归引用
+        refs = {}
+    if not isinstance(schema, dict):
+        # true / 空 schema 接受任意值
+        return lambda value, path, errors: value
+
+    checks: list[Validator] = []
+
+    if "$ref" in schema:
+        ref = schema["$ref"]
+        if ref not in refs:
+            target = _resolve_ref(ref, root)
+            if target is not None:
+                compiled: list[Validator] = []
+                refs[ref] = lambda value, path, errors: compiled[0](value, path, errors)
+                compiled.append(_compile(target, root, refs))
+        if ref in refs:
+            checks.append(refs[ref])
+
+    if "type" in schema:
+        types_ = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        checks.append(_compile_type(types_))
+
+    if "anyOf" in schema:
+        checks.append(_compile_any_of([_compile(s, root, refs) for s in schema["anyOf"]]))
+
+    if "oneOf" in schema:
+        checks.append(_compile_one_of([_compile(s, root, refs) for s in schema["oneOf"]]))
+
+    if "allOf" in schema:
+        for subschema in schema["allOf"]:
+            checks.append(_compile(subschema, root, refs))
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path, errors):
+            if value not in allowed:
+                errors.append(f"{path}: {value!r} is not one of {allowed}")
+            return value
+        checks.append(check_enum)
+
+    if "const" in schema:
+        expected = schema["const"]
+
+        def check_const(value, path, errors):
+            if value != expected:
+                errors.append(f"{path}: expected {expected!r}")
+            return value
+        checks.append(check_const)
+
+    minimum, maximum = schema.get("minimum"), schema.get("maximum")
+    if minimum is not None or maximum is not None:
+        def check_range(value, path, errors):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if minimum is not None and value < minimum:
+                    errors.append(f"{path}: {value} is less than minimum {minimum}")
+                if maximum is not None and value > maximum:
+                    errors.append(f"{path}: {value} is greater than maximum {maximum}")
+            return value
+        checks.append(check_range)
+
+    min_length, max_length = schema.get("minLength"), schema.get("maxLength")
+    if min_length is not None or max_length is not None:
+        def check_length(value, path, errors):
+            if isinstance(value, str):
+                if min_length is not None and len(value) < min_length:
+                    errors.append(f"{path}: shorter than {min_length} characters")
+                if max_length is not None and len(value) > max_length:
+                    errors.append(f"{path}: longer than {max_length} characters")
+            return value
+        checks.append(check_length)
+
+    if "properties" in schema or "required" in schema or "additionalProperties" in schema:
+        properties = {name: _compile(sub, root, refs) for name, sub in schema.get("properties", {}).items()}
+        defaults = {
+            name: sub["default"]
+            for name, sub in schema.get("properties", {}).items()
+            if isinstance(sub, dict) and "default" in sub
+        }
+        required = list(schema.get("required", []))
+        additional = schema.get("additionalProperties", True)
+        additional_check = _compile(additional, root, refs) if isinstance(additional, dict) else None
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return value
+            result = {}
+            for name in required:
+                if name not in value and name not in defaults:
+                    errors.append(f"{path}.{name}: required property is missing")
+            for name, item in value.items():
+                if name in properties:
+                    result[name] = properties[name](item, f"{path}.{name}", errors)
+                elif additional is False:
+                    errors.append(f"{path}.{name}: unexpected property")
+                elif additional_check is not None:
+                    result[name] = additional_check(item, f"{path}.{name}", errors)
+                else:
+                    result[name] = item
+            return result
+        checks.append(check_object)
+
+    if "items" in schema:
+        item_check = _compile(schema["items"], root, refs)
+
+        def check_array(value, path, errors):
+            if not isinstance(value, list):
+                return value
+            return [item_check(item, f"{path}[{i}]", errors) for i, item in enumerate(value)]
+        checks.append(check_array)
+
+    def validate(value, path, errors):
+        for check in checks:
+            value = check(value, path, errors)
+        return value
+    return validate
+
+
+class ToolValidators:
+    """按工具名缓存编译好的校验函数
+
+    相同的 schema 只编译一次（按 schema 内容的哈希去重），工具列表刷新时调用 load()
+    重建映射即可。
+    """
+
+    def __init__(self):
+        self._by_schema: dict[str, Validator] = {}
+        self._by_tool: dict[str, Validator] = {}
+
+    @staticmethod
+    def _schema_key(schema: Any) -> str:
+        return hashlib.sha1(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+
+    def load(self, tools) -> None:
+        """根据 MCP 工具列表编译（或复用）每个工具的校验函数"""
+        by_schema: dict[str, Validator] = {}
+        by_tool: dict[str, Validator] = {}
+        for tool in tools:
+            key = self._schema_key(tool.inputSchema)
+            validator = by_schema.get(key) or self._by_schema.get(key) or _compile(tool.inputSchema)
+            by_schema[key] = validator
+            by_tool[tool.name] = validator
+        self._by_schema = by_schema
+        self._by_tool = by_tool
+
+    def validate(self, tool_name: str, arguments: Any) -> dict:
+        """校验并转换参数，失败时抛出 ToolArgumentError"""
+        validator = self._by_tool.get(tool_name)
+        if validator is None:
+            raise ToolArgumentError(tool_name, [f"unknown tool {tool_name}"])
+        if not isinstance(arguments, dict):
+            raise ToolArgumentError(tool_name, ["arguments must be a JSON object"])
+        errors: list[str] = []
+        result = validator(arguments, "$", errors)
+        if errors:
+            raise ToolArgumentError(tool_name, errors)
+        return result
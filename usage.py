@@ -0,0 +1,168 @@
+"""Token 用量统计与预算控制
+
+记录每次 chat completion 返回的 response.usage（prompt / completion / cached tokens），
+按阶段（tools: 带工具的首次请求，final: 工具调用后的总结请求）、按工具轮次、
+按工具和按会话累计，并在请求发送前按预算检查。
+"""
+import time
+from typing import Any, Iterable, Optional
+
+
+class BudgetExceeded(Exception):
+    """请求超出 token 预算且无法通过压缩历史解决"""
+
+
+class TokenCounts:
+    __slots__ = ("prompt", "completion", "cached", "requests", "seconds")
+
+    def __init__(self):
+        self.prompt = 0
+        self.completion = 0
+        self.cached = 0
+        self.requests = 0
+        self.seconds = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.prompt + self.completion
+
+    def add(self, usage: Any, seconds: float = 0.0) -> None:
+        """累加一个 OpenAI 的 CompletionUsage（或另一个 TokenCounts）"""
+        if isinstance(usage, TokenCounts):
+            self.prompt += usage.prompt
+            self.completion += usage.completion
+            self.cached += usage.cached
+            self.requests += usage.requests
+            self.seconds += usage.seconds
+            return
+        self.requests += 1
+        self.seconds += seconds
+        if usage is None:
+            return
+        self.prompt += usage.prompt_tokens or 0
+        self.completion += usage.completion_tokens or 0
+        self.cached += cached_tokens(usage)
+
+    def as_dict(self) -> dict:
+        return {
+            "prompt_tokens": self.prompt,
+            "completion_tokens": self.completion,
+            "cached_tokens": self.cached,
+            "total_tokens": self.total,
+            "requests": self.requests,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def cached_tokens(usage: Any) -> int:
+    """缓存命中的 prompt tokens（OpenAI: prompt_tokens_details，DeepSeek: prompt_cache_hit_tokens）"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None and getattr(details, "cached_tokens", None):
+        return details.cached_tokens
+    return getattr(usage, "prompt_cache_hit_tokens", None) or 0
+
+
+def estimate_tokens(messages: Iterable[dict], tools: Optional[list] = None) -> int:
+    """发送前粗略估算 prompt tokens（约 4 个字符一个 token）"""
+    chars = 0
+    for message in messages:
+        chars += len(message.get("content") or "") + 8
+        for call in message.get("tool_calls") or ():
+            chars += len(call["function"]["name"]) + len(call["function"]["arguments"])
+    if tools:
+        chars += len(str(tools))
+    return chars // 4 + 1
+
+
+class QueryUsage:
+    """单次 process_query 的用量"""
+
+    __slots__ = ("total", "phases", "rounds", "tools")
+
+    def __init__(self):
+        self.total = TokenCounts()
+        self.phases: dict[str, TokenCounts] = {}
+        self.rounds: list[dict] = []
+        self.tools: dict[str, dict] = {}
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total.as_dict(),
+            "phases": {phase: counts.as_dict() for phase, counts in self.phases.items()},
+            "rounds": self.rounds,
+            "tools": self.tools,
+        }
+
+
+class UsageTracker:
+    """会话级用量统计和预算
+
+    Args:
+        session_budget: 整个会话允许使用的 token 总数，None 表示不限制
+        query_budget: 单次查询允许使用的 token 总数，None 表示不限制
+        completion_reserve: 设置了预算时，每次请求为回复预留的 token 数，同时作为 max_tokens 传给 API
+    """
+
+    def __init__(self, session_budget: Optional[int] = None, query_budget: Optional[int] = None,
+                 completion_reserve: int = 1024):
+        self.session_budget = session_budget
+        self.query_budget = query_budget
+        self.completion_reserve = completion_reserve
+        self.session = TokenCounts()
+        self.phases: dict[str, TokenCounts] = {}
+        self.tools: dict[str, dict] = {}
+        self.queries = 0
+
+    def start_query(self) -> QueryUsage:
+        self.queries += 1
+        return QueryUsage()
+
+    def allowance(self, query: QueryUsage) -> Optional[int]:
+        """当前查询还能使用的 token 数，None 表示不限制"""
+        limits = []
+        if self.session_budget is not None:
+            limits.append(self.session_budget - self.session.total)
+        if self.query_budget is not None:
+            limits.append(self.query_budget - query.total.total)
+        return min(limits) if limits else None
+
+    def record(self, query: QueryUsage, phase: str, usage: Any, started: float, tool_names: Iterable[str] = ()) -> None:
+        """记录一次 chat completion 的用量，started 为请求开始时的 time.perf_counter()"""
+        seconds = time.perf_counter() - started
+        counts = TokenCounts()
+        counts.add(usage, seconds)
+        query.total.add(counts)
+        query.phases.setdefault(phase, TokenCounts()).add(counts)
+        query.rounds.append({"phase": phase, "tools": list(tool_names), **counts.as_dict()})
+        self.session.add(counts)
+        self.phases.setdefault(phase, TokenCounts()).add(counts)
+
+    def record_tool(self, query: QueryUsage, tool_name: str, content: str) -> None:
+        """记录一次工具调用，以及它的结果带入下一次请求的估算 tokens"""
+        result_tokens = len(content) // 4 + 1
+        for stats in (query.tools, self.tools):
+            entry = stats.setdefault(tool_name, {"calls": 0, "result_tokens_estimate": 0})
+            entry["calls"] += 1
+            entry["result_tokens_estimate"] += result_tokens
+
+    def report(self) -> dict:
+        """会话的汇总报告"""
+        return {
+            "queries": self.queries,
+            "session": self.session.as_dict(),
+            "session_budget": self.session_budget,
+            "query_budget": self.query_budget,
+            "phases": {phase: counts.as_dict() for phase, counts in self.phases.items()},
+            "tools": self.tools,
+        }
+
+
+class QueryResult(str):
+    """process_query 的返回值：仍然是回复文本，同时带上本次查询的用量"""
+
+    usage: QueryUsage
+
+    def __new__(cls, text: str, usage: QueryUsage):
+        result = super().__new__(cls, text)
+        result.usage = usage
+        return result
@@ -1,7 +1,13 @@
 from typing import Any
+from collections import OrderedDict
+from urllib.parse import urlparse
+import asyncio
+import functools
+import time
 import httpx
 from mcp.server.fastmcp import FastMCP , Context
 import mcp.types as types
+from circuit_breaker import CircuitBreaker
 
 # Initialize FastMCP server
 mcp = FastMCP("weather", log_level="ERROR")
@@ -9,21 +15,86 @@ mcp = FastMCP("weather", log_level="ERROR")
 # Constants
 NWS_API_BASE = "https://api.weather.gov"
 USER_AGENT = "weather-app/1.0"
+# Upper bound on concurrent NWS requests issued by the bulk tools
+MAX_CONCURRENT_REQUESTS = 5
 
 
-async def make_nws_request(url: str) -> dict[str, Any] | None:
-    """Make a request to the NWS API with proper error handling."""
+# Upstream timeouts: fail fast on connect, allow a little longer for the body
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 10.0
+# Circuit breaker settings are in circuit_breaker.py, one breaker per NWS endpoint
+# Last good responses, served when the upstream is unavailable
+STALE_CACHE_SIZE = 256
+
+
+breakers: dict[str, CircuitBreaker] = {}
+stale_cache: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """Return the breaker of the endpoint (alerts, points, gridpoints, ...) a URL belongs to."""
+    parsed = urlparse(url)
+    name = f"{parsed.netloc}/{parsed.path.strip('/').split('/')[0]}"
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name)
+    return breakers[name]
+
+
+def serve_stale(url: str, reason: str) -> tuple[dict[str, Any] | None, str]:
+    """Fall back to the last good response for url, if any."""
+    if url in stale_cache:
+        fetched_at, data = stale_cache[url]
+        age = int(time.monotonic() - fetched_at)
+        return data, f"[Upstream status: {reason}; showing cached data from {age}s ago]"
+    return None, f"[Upstream status: {reason}]"
+
+
+async def make_nws_request(url: str) -> tuple[dict[str, Any] | None, str | None]:
+    """Make a request to the NWS API with proper error handling.
+
+    Returns (data, status) where status describes upstream problems (circuit open,
+    stale data served) for the tool text, or is None when the request went through.
+    """
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        return serve_stale(url, f"NWS {breaker.name} is unavailable, circuit open, retrying in {breaker.retry_in():.0f}s")
+
     headers = {
         "User-Agent": USER_AGENT,
         "Accept": "application/geo+json"
     }
+    timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
     async with httpx.AsyncClient() as client:
         try:
-            response = await client.get(url, headers=headers, timeout=30.0)
+            response = await client.get(url, headers=headers, timeout=timeout)
             response.raise_for_status()
-            return response.json()
-        except Exception:
-            return None
+            data = response.json()
+        except httpx.HTTPStatusError as e:
+            # 4xx (e.g. unknown point) is a bad request, not an upstream outage
+            status_code = e.response.status_code
+            upstream_failure = status_code >= 500 or status_code == 429
+            breaker.record(not upstream_failure)
+            if upstream_failure:
+                return serve_stale(url, f"NWS {breaker.name} returned HTTP {status_code}")
+            return None, None
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as e:
+            breaker.record(False)
+            return serve_stale(url, f"NWS {breaker.name} request failed ({type(e).__name__})")
+
+    breaker.record(True)
+    stale_cache[url] = (time.monotonic(), data)
+    stale_cache.move_to_end(url)
+    if len(stale_cache) > STALE_CACHE_SIZE:
+        stale_cache.popitem(last=False)
+    return data, None
+
+
+def with_status(text: str, status: str | None) -> str:
+    """Append the upstream status line, if any, to a tool result."""
+    return f"{text}\n{status}" if status else text
 
 def format_alert(feature: dict) -> str:
     """Format an alert feature into a readable string."""
@@ -37,46 +108,40 @@ Instructions: {props.get('instruction', 'No specific instructions provided')}
 """
 
 
-@mcp.tool()
-async def get_alerts(state: str) -> str:
-    """Get weather alerts for a US state.
-
-    Args:
-        state: Two-letter US state code (e.g. CA, NY)
-    """
+async def fetch_alerts(state: str) -> tuple[bool, str]:
+    """Fetch and format alerts for one state. Returns (ok, text)."""
     url = f"{NWS_API_BASE}/alerts/active/area/{state}"
-    data = await make_nws_request(url)
+    data, status = await make_nws_request(url)
 
     if not data or "features" not in data:
-        return "Unable to fetch alerts or no alerts found."
+        return False, with_status("Unable to fetch alerts or no alerts found.", status)
 
     if not data["features"]:
-        return "No active alerts for this state."
+        return True, with_status("No active alerts for this state.", status)
 
     alerts = [format_alert(feature) for feature in data["features"]]
-    return "\n---\n".join(alerts)
+    return True, with_status("\n---\n".join(alerts), status)
 
-@mcp.tool()
-async def get_forecast(latitude: float, longitude: float) -> str:
-    """Get weather forecast for a location.
 
-    Args:
-        latitude: Latitude of the location
-        longitude: Longitude of the location
+async def fetch_forecast_url(latitude: float, longitude: float) -> tuple[str | None, str | None]:
+    """Look up the forecast endpoint of the grid point covering a location.
+
+    Returns (forecast_url, upstream status).
     """
-    # First get the forecast grid endpoint
     points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
-    points_data = await make_nws_request(points_url)
+    points_data, status = await make_nws_request(points_url)
 
     if not points_data:
-        return "Unable to fetch forecast data for this location."
+        return None, status
+    return points_data["properties"]["forecast"], status
+
 
-    # Get the forecast URL from the points response
-    forecast_url = points_data["properties"]["forecast"]
-    forecast_data = await make_nws_request(forecast_url)
+async def fetch_forecast(forecast_url: str) -> tuple[bool, str]:
+    """Fetch and format a grid point forecast. Returns (ok, text)."""
+    forecast_data, status = await make_nws_request(forecast_url)
 
     if not forecast_data:
-        return "Unable to fetch detailed forecast."
+        return False, with_status("Unable to fetch detailed forecast.", status)
 
     # Format the periods into a readable forecast
     periods = forecast_data["properties"]["periods"]
@@ -90,7 +155,130 @@ Forecast: {period['detailedForecast']}
 """
         forecasts.append(forecast)
 
-    return "\n---\n".join(forecasts)
+    return True, with_status("\n---\n".join(forecasts), status)
+
+
+async def gather_bounded(calls: list, on_error) -> list:
+    """Run zero-argument async callables concurrently, at most MAX_CONCURRENT_REQUESTS at a time.
+
+    Each coroutine is only created once its slot is acquired, so items still waiting
+    when the batch is cancelled are never started (and never left un-awaited).
+    An item that raises (e.g. an unexpected NWS payload) is replaced by on_error(exception),
+    so one bad item does not fail the whole batch.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def run(call):
+        async with semaphore:
+            try:
+                return await call()
+            except Exception as e:
+                return on_error(e)
+
+    return await asyncio.gather(*[run(call) for call in calls])
+
+
+def format_bulk(title: str, results: list[tuple[str, bool, str]]) -> str:
+    """Format per-item results of a bulk tool, reporting partial failures."""
+    failed = [label for label, ok, _ in results if not ok]
+    summary = f"{title}: {len(results) - len(failed)} of {len(results)} succeeded"
+    if failed:
+        summary += f" (failed: {'; '.join(failed)})"
+    sections = [f"=== {label} [{'OK' if ok else 'FAILED'}] ===\n{text}" for label, ok, text in results]
+    return "\n\n".join([summary] + sections)
+
+
+@mcp.tool()
+async def get_alerts(state: str) -> str:
+    """Get weather alerts for a US state.
+
+    Args:
+        state: Two-letter US state code (e.g. CA, NY)
+    """
+    _, text = await fetch_alerts(state)
+    return text
+
+@mcp.tool()
+async def get_forecast(latitude: float, longitude: float) -> str:
+    """Get weather forecast for a location.
+
+    Args:
+        latitude: Latitude of the location
+        longitude: Longitude of the location
+    """
+    # First get the forecast grid endpoint
+    forecast_url, status = await fetch_forecast_url(latitude, longitude)
+
+    if not forecast_url:
+        return with_status("Unable to fetch forecast data for this location.", status)
+
+    _, text = await fetch_forecast(forecast_url)
+    return with_status(text, status)
+
+
+@mcp.tool()
+async def get_alerts_bulk(states: list[str]) -> str:
+    """Get weather alerts for several US states in one call.
+
+    Args:
+        states: List of two-letter US state codes (e.g. ["CA", "NY"])
+    """
+    # Fetch each distinct state once
+    unique_states = list(dict.fromkeys(state.strip().upper() for state in states))
+    fetched = await gather_bounded(
+        [functools.partial(fetch_alerts, state) for state in unique_states],
+        lambda e: (False, f"Unable to fetch alerts: unexpected NWS response ({type(e).__name__})."),
+    )
+    by_state = dict(zip(unique_states, fetched))
+
+    return format_bulk("Alerts", [(state, *by_state[state]) for state in unique_states])
+
+
+@mcp.tool()
+async def get_forecast_bulk(locations: list[dict[str, float]]) -> str:
+    """Get weather forecasts for several locations in one call.
+
+    Args:
+        locations: List of {"latitude": ..., "longitude": ...} objects
+    """
+    labels = []
+    coords = []
+    for location in locations:
+        labels.append(f"{location.get('latitude')},{location.get('longitude')}")
+        try:
+            # NWS accepts at most 4 decimal places; identical points are looked up once
+            coords.append((round(float(location["latitude"]), 4), round(float(location["longitude"]), 4)))
+        except (KeyError, TypeError, ValueError):
+            coords.append(None)
+
+    unique_points = list(dict.fromkeys(point for point in coords if point is not None))
+    lookups = dict(zip(
+        unique_points,
+        await gather_bounded(
+            [functools.partial(fetch_forecast_url, lat, lon) for lat, lon in unique_points],
+            lambda e: (None, f"[Upstream status: unexpected NWS points response ({type(e).__name__})]"),
+        ),
+    ))
+    forecast_urls = {point: url for point, (url, _) in lookups.items()}
+
+    # Nearby coordinates often share one forecast grid point, fetch each grid once
+    unique_urls = list(dict.fromkeys(url for url in forecast_urls.values() if url))
+    forecasts = dict(zip(unique_urls, await gather_bounded(
+        [functools.partial(fetch_forecast, url) for url in unique_urls],
+        lambda e: (False, f"Unable to fetch detailed forecast: unexpected NWS response ({type(e).__name__})."),
+    )))
+
+    results = []
+    for label, point in zip(labels, coords):
+        if point is None:
+            results.append((label, False, "Invalid location, expected latitude and longitude."))
+        elif not forecast_urls[point]:
+            results.append((label, False, with_status("Unable to fetch forecast data for this location.", lookups[point][1])))
+        else:
+            ok, text = forecasts[forecast_urls[point]]
+            results.append((label, ok, with_status(text, lookups[point][1])))
+
+    return format_bulk("Forecasts", results)
 
 
 @mcp.tool()